@@ -1,6 +1,13 @@
 # realtime_check.py
-import os, json, time, requests, datetime, subprocess
-import yfinance as yf
+import os, re, json, time, requests, datetime, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import orjson
+except ImportError:  # optional: fall back to stdlib json
+    orjson = None
 
 # ---------- CONFIG ----------
 THRESHOLDS = {
@@ -10,68 +17,147 @@ THRESHOLDS = {
 }
 TICKERS = list(THRESHOLDS.keys())
 STATUS_FILE = "alerts_status.json"
+MAX_NEWS_IDS = 500   # keep only the most recently seen ids in the status file
 TOKEN = os.environ.get("TELEGRAM_TOKEN")
 CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 MARKETAUX_TOKEN = "demo"   # demo token (free) - change if you have key
+TG_MAX_CHARS = 4000   # telegram caps sendMessage text at 4096 chars
+TH_TZ = ZoneInfo("Asia/Bangkok")
+US_MARKET_TZ = ZoneInfo("America/New_York")
+NEWS_KEYWORDS = ["contract","launch","earnings","acquir","nasa","defense","investor","partnership","agreement","merger","acquisition","delay","failure","success"]
 # ----------------------------
 
+# one case-insensitive scan per title instead of a substring test per keyword
+_NEWS_KW_RE = re.compile("|".join(map(re.escape, NEWS_KEYWORDS)), re.I)
+
+# shared keep-alive session for marketaux + telegram (retries idempotent GETs only).
+# Retry-After is ignored so a 429/503 (likely on the demo quota) can't make the
+# fetch threads sleep for whatever the server asks; backoff is 0s then 0.6s.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                      respect_retry_after_header=False),
+))
+# telegram sendMessage: also retry the POST, but only on connect errors, where
+# the message certainly never reached telegram. No retry after a read error or a
+# 5xx (a 502/504 can arrive after telegram already took the message), and none on
+# 429 -- a retry 0-1s later lands inside the flood-control window anyway.
+# Worst case is 3 attempts x 15s timeout + 1s backoff.
+SESSION.mount("https://api.telegram.org/", HTTPAdapter(
+    max_retries=Retry(total=2, read=0, backoff_factor=0.5, respect_retry_after_header=False),
+))
+
+def _json(r):
+    # decode an HTTP response body, with orjson when it's available
+    if orjson is not None:
+        return orjson.loads(r.content)
+    return r.json()
+
 def load_status():
     if not os.path.exists(STATUS_FILE):
         return {"price_alerts": {}, "news_ids": []}
-    with open(STATUS_FILE, "r") as f:
-        return json.load(f)
+    with open(STATUS_FILE, "rb") as f:
+        data = f.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
 
 def save_status(status):
-    with open(STATUS_FILE, "w") as f:
-        json.dump(status, f, indent=2)
+    # write to a temp file and rename so a killed run can't leave half a JSON file
+    if orjson is not None:
+        data = orjson.dumps(status, option=orjson.OPT_INDENT_2)
+    else:
+        # ensure_ascii=False so the bytes match orjson's raw UTF-8 output
+        data = json.dumps(status, indent=2, ensure_ascii=False).encode()
+    tmp = STATUS_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, STATUS_FILE)
 
-def get_price(ticker):
+def get_prices(tickers):
+    # one batched download for all tickers instead of a history() call each
+    out = {t: None for t in tickers}
+    t0 = time.perf_counter()
     try:
-        d = yf.Ticker(ticker).history(period="2d")
-        if d.empty:
-            return None
-        p = float(d['Close'][-1])
-        prev = float(d['Close'][-2]) if len(d['Close'])>1 else p
-        pct = (p-prev)/prev*100 if prev!=0 else 0.0
-        return {"price": round(p,4), "pct": round(pct,2)}
+        import yfinance as yf  # deferred: pulls in pandas/numpy
+        d = yf.download(tickers, period="2d", group_by="ticker", progress=False, threads=True)
     except Exception as e:
-        print("price err", ticker, e)
-        return None
+        print("price err", e)
+        return out
+    print(f"prices fetched in {time.perf_counter()-t0:.2f}s")
+    for t in tickers:
+        try:
+            closes = d[t]["Close"].dropna().to_numpy()
+            if closes.size == 0:
+                continue
+            p = float(closes[-1])
+            prev = float(closes[-2]) if closes.size>1 else p
+            pct = (p-prev)/prev*100 if prev!=0 else 0.0
+            out[t] = {"price": round(p,4), "pct": round(pct,2)}
+        except Exception as e:
+            print("price err", t, e)
+    return out
 
 def get_news_for(ticker):
+    t0 = time.perf_counter()
     try:
         url = f"https://api.marketaux.com/v1/news/all?search={ticker}&countries=us&limit=5&api_token={MARKETAUX_TOKEN}"
-        r = requests.get(url, timeout=10).json()
-        return r.get("data", [])
-    except Exception as e:
-        print("news err", e)
+        resp = SESSION.get(url, timeout=10)
+        resp.raise_for_status()
+        r = _json(resp)
+    except (requests.RequestException, ValueError) as e:
+        print("news err", ticker, e)
         return []
+    print(f"news {ticker} fetched in {time.perf_counter()-t0:.2f}s")
+    return r.get("data", []) if isinstance(r, dict) else []
 
 def send_telegram(text):
     if not TOKEN or not CHAT_ID:
         print("Missing TELEGRAM_TOKEN or TELEGRAM_CHAT_ID")
         return False
     url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
-    payload = {"chat_id": CHAT_ID, "text": text}
+    payload = {"chat_id": CHAT_ID, "text": text, "disable_web_page_preview": True}
     try:
-        r = requests.post(url, data=payload, timeout=15)
+        r = SESSION.post(url, json=payload, timeout=15)
         print("tg status", r.status_code)
         try:
-            print("tg resp", r.json())
-        except:
+            print("tg resp", _json(r))
+        except ValueError:
             print("tg text", r.text)
         return r.status_code == 200
-    except Exception as e:
+    except requests.RequestException as e:
         print("tg send err", e)
         return False
 
+def send_telegram_batch(messages):
+    # pack messages into as few sendMessage calls as fit under TG_MAX_CHARS;
+    # returns True only if every chunk was delivered
+    chunks, chunk, size = [], [], 0
+    for m in messages:
+        m = m.strip()[:TG_MAX_CHARS]
+        if chunk and size + 2 + len(m) > TG_MAX_CHARS:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        size += len(m) + (2 if chunk else 0)
+        chunk.append(m)
+    if chunk:
+        chunks.append(chunk)
+    ok = True
+    for i, c in enumerate(chunks, 1):
+        text = "\n\n".join(c)
+        if not send_telegram(text):
+            # main() skips saving the status on failure so the next run retries;
+            # keep the undelivered text in the job log meanwhile
+            print(f"tg batch: chunk {i}/{len(chunks)} ({len(c)} alerts) NOT sent:\n{text}")
+            ok = False
+    return ok
+
 def git_commit_push(filename, commit_msg="Update alerts status"):
-    # Use GITHUB_TOKEN-based auth via actions runner; ensure git config set in workflow
+    # Use GITHUB_TOKEN-based auth via actions runner
     try:
-        subprocess.run(["git", "config", "--global", "user.email", "actions@github.com"], check=True)
-        subprocess.run(["git", "config", "--global", "user.name", "github-actions[bot]"], check=True)
         subprocess.run(["git", "add", filename], check=True)
-        subprocess.run(["git", "commit", "-m", commit_msg], check=True)
+        # identity passed inline: no global git config needed, no extra processes
+        subprocess.run(["git", "-c", "user.name=github-actions[bot]", "-c", "user.email=actions@github.com",
+                        "commit", "-m", commit_msg], check=True)
         # push using token already available in env (GITHUB_TOKEN) via remote origin
         subprocess.run(["git", "push"], check=True)
         return True
@@ -79,64 +165,88 @@ def git_commit_push(filename, commit_msg="Update alerts status"):
         print("git push error", e)
         return False
 
+def us_market_hours(now):
+    # weekday 09:00-16:59 New York time (covers the 09:30-16:00 session)
+    et = now.astimezone(US_MARKET_TZ)
+    return et.weekday() < 5 and 9 <= et.hour < 17
+
 def main():
-    now = datetime.datetime.utcnow() + datetime.timedelta(hours=7)
+    now = datetime.datetime.now(TH_TZ)
     status = load_status()
     updated = False
 
-    # PRICE ALERTS
-    for t in TICKERS:
-        info = get_price(t)
-        if not info:
-            continue
-        p = info["price"]
-        pct = info["pct"]
-        sent = status.get("price_alerts", {}).get(t, False)
-        threshold = THRESHOLDS[t]
-        # trigger when price <= threshold AND not yet sent
-        if p <= threshold and not sent:
-            text = f"⚡️ PRICE ALERT: {t} reached golden timing ${p:.2f} (threshold {threshold}) at {now:%Y-%m-%d %H:%M} TH\nChange {pct:+.2f}%\n"
-            send_telegram(text)
-            status.setdefault("price_alerts", {})[t] = True
-            updated = True
-        # if price back above threshold, reset sent flag (so future crossing triggers again)
-        if p > threshold and sent:
-            status.setdefault("price_alerts", {})[t] = False
-            updated = True
+    # fetch prices and news for all tickers concurrently (network-bound)
+    with ThreadPoolExecutor(max_workers=len(TICKERS) + 1) as ex:
+        price_fut = ex.submit(get_prices, TICKERS)
+        news_futs = {t: ex.submit(get_news_for, t) for t in TICKERS}
+        prices = price_fut.result()
+        news = {t: f.result() for t, f in news_futs.items()}
 
-    # NEWS ALERTS (new articles)
+    # seen news ids as an ordered set (dict), oldest-seen first. Ids still in
+    # this run's feed are moved to the end, and the log is only trimmed to
+    # MAX_NEWS_IDS when written back, so an id the feed still returns is never
+    # evicted -- even from an old status file whose list was saved in set order.
+    seen = dict.fromkeys(status.get("news_ids", []))
+    price_alerts = status.setdefault("price_alerts", {})
+    pending = []  # alerts for this run, sent together at the end
+
+    # one pass per ticker: price alert, then any new articles
     for t in TICKERS:
-        articles = get_news_for(t)
-        seen = set(status.get("news_ids", []))
-        for a in articles:
+        # PRICE ALERT
+        info = prices[t]
+        if info:
+            p = info["price"]
+            pct = info["pct"]
+            sent = price_alerts.get(t, False)
+            threshold = THRESHOLDS[t]
+            # trigger when price <= threshold AND not yet sent
+            if p <= threshold and not sent:
+                text = f"⚡️ PRICE ALERT: {t} reached golden timing ${p:.2f} (threshold {threshold}) at {now:%Y-%m-%d %H:%M} TH\nChange {pct:+.2f}%\n"
+                pending.append(text)
+                price_alerts[t] = True
+                updated = True
+            # if price back above threshold, reset sent flag (so future crossing triggers again)
+            if p > threshold and sent:
+                price_alerts[t] = False
+                updated = True
+
+        # NEWS ALERTS (new articles)
+        for a in news[t]:
             aid = a.get("id") or (a.get("url") or a.get("title"))
             if not aid:
                 continue
             if aid in seen:
+                seen[aid] = seen.pop(aid)  # still in the feed: mark as recently seen
                 continue
             # basic filter: relevant keywords present in title
             title = a.get("title","")
             url = a.get("url","")
             # only alert if title seems significant (length > 30 or contains key words)
-            if len(title) > 30 or any(k in title.lower() for k in ["contract","launch","earnings","acquir","nasa","defense","investor","partnership","agreement","merger","acquisition","delay","failure","success"]):
+            if len(title) > 30 or _NEWS_KW_RE.search(title):
                 text = f"🗞 NEWS ALERT ({t}): {title}\n{url}"
-                send_telegram(text)
+                pending.append(text)
             # mark as seen regardless to avoid repeated noisy alerts
-            seen.add(aid)
+            seen[aid] = None
             updated = True
-        status["news_ids"] = list(seen)
+    status["news_ids"] = list(seen)[-MAX_NEWS_IDS:]
 
     # DAILY PORTFOLIO SNAPSHOT at each run (optional short)
-    # We will send a short snapshot every hour to avoid spam (check minute==00)
-    if datetime.datetime.utcnow().minute == 0:  # send hourly snapshot at top of hour (UTC)
-        snap = f"📊 Snapshot {now:%Y-%m-%d %H:%M} TH\n"
+    # We will send a short snapshot every hour to avoid spam (check minute==00),
+    # and only while US markets are open -- prices don't move otherwise
+    if now.minute == 0 and us_market_hours(now):  # send hourly snapshot at top of hour
+        lines = [f"📊 Snapshot {now:%Y-%m-%d %H:%M} TH"]
         for t in TICKERS:
-            info = get_price(t)
+            info = prices[t]  # reuse this run's quotes, no second download
             if not info:
-                snap += f"{t}: no data\n"
+                lines.append(f"{t}: no data")
             else:
-                snap += f"{t}: ${info['price']:.2f} ({info['pct']:+.2f}%)\n"
-        send_telegram(snap)
+                lines.append(f"{t}: ${info['price']:.2f} ({info['pct']:+.2f}%)")
+        pending.append("\n".join(lines))
+
+    if not send_telegram_batch(pending):
+        # keep the old status so the next cron run re-detects and resends these
+        print("warning: some alerts were not delivered; status not saved, will retry next run")
+        return
 
     if updated:
         save_status(status)